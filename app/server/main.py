@@ -4,6 +4,7 @@
 import os
 import re
 import datetime
+from time import time_ns
 import numpy as np
 from io import BytesIO
 from PIL import Image
@@ -18,8 +19,10 @@ import boto3
 import json
 import asyncio
 import websockets
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError
+from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
 from fastapi import FastAPI, File, UploadFile, HTTPException, BackgroundTasks, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import Response, RedirectResponse
+from starlette.concurrency import run_in_threadpool
 import sys
 from botocore import UNSIGNED
 from botocore.client import Config
@@ -28,6 +31,11 @@ import tempfile
 import shutil
 import jwt
 import httpx
+import threading
+import posixpath
+from collections import OrderedDict
+from concurrent.futures import Future
+from email.utils import formatdate
 
 class RTNotificationTestInput(pydantic.BaseModel):
     message: str
@@ -35,6 +43,13 @@ class RTNotificationTestInput(pydantic.BaseModel):
 class VideoClipRequest(pydantic.BaseModel):
     video_link: str
 
+class EncodingProfile(pydantic.BaseModel):
+    preset: str
+    crf: int
+    # Height of the low-resolution preview rendition; None disables it
+    preview_height: int | None = None
+    preview_crf: int = 28
+
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
@@ -52,6 +67,291 @@ class ConnectionManager:
     async def broadcast(self, message: str):
         for connection in self.active_connections:
             await connection.send_text(message)
+
+class VideoCache:
+    """
+    Size-bounded on-disk LRU cache of video clips, keyed by their S3 object key.
+    Files are written to a temporary .part file and renamed into place, so a
+    reader never sees a partially written clip.
+    """
+    ALLOWED_PREFIXES = ("videos/", "previews/")
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.entries: OrderedDict[str, int] = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        # S3 downloads in progress, so concurrent misses for a key share one download
+        self.fetching: dict[str, Future] = {}
+        # Keys known to exceed max_bytes, which are served from S3 without downloading
+        self.too_large: set[str] = set()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        # Rebuild the index from disk, least recently used (oldest atime) first
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith(".part"):
+                    os.remove(path)
+                    continue
+                key = os.path.relpath(path, self.cache_dir).replace(os.sep, "/")
+                if not self.is_valid_key(key):
+                    print(f"Ignoring unexpected file in video cache: {path}")
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_atime_ns, key, stat.st_size))
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.total_bytes += size
+        with self.lock:
+            self._evict()
+
+    @classmethod
+    def is_valid_key(cls, key: str) -> bool:
+        """Accept only normalized keys under the video prefixes, with no empty, '.' or '..' segments."""
+        if not key.startswith(cls.ALLOWED_PREFIXES) or posixpath.normpath(key) != key:
+            return False
+        return all(segment not in ("", ".", "..") for segment in key.split("/"))
+
+    def path_for(self, key: str) -> str:
+        """Map an S3 key to its cache path, rejecting invalid keys."""
+        if not self.is_valid_key(key):
+            raise ValueError(f"Invalid video key: {key}")
+        return os.path.join(self.cache_dir, *key.split("/"))
+
+    def open(self, key: str):
+        """Open a cached clip for reading and mark it as recently used, or return None on a miss."""
+        path = self.path_for(key)
+        with self.lock:
+            if key not in self.entries:
+                return None
+            try:
+                file = open(path, 'rb')
+            except FileNotFoundError:
+                self.total_bytes -= self.entries.pop(key)
+                return None
+            self.entries.move_to_end(key)
+        try:
+            # Record the access in atime so LRU order survives a restart.
+            # mtime is left alone because the ETag is derived from it.
+            stat = os.fstat(file.fileno())
+            os.utime(file.fileno(), ns=(time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+        return file
+
+    def put_file(self, key: str, src_path: str):
+        """Copy a local clip into the cache."""
+        part_path = self._part_path(key)
+        try:
+            shutil.copyfile(src_path, part_path)
+        except Exception:
+            os.remove(part_path)
+            raise
+        self._commit(key, part_path)
+
+    def fetch(self, key: str):
+        """
+        Download a clip from S3 into the cache. If the clip is already being
+        downloaded, wait for that download instead of starting another.
+        Clips larger than the cache are not downloaded.
+        """
+        self.path_for(key)
+        with self.lock:
+            if key in self.entries or key in self.too_large:
+                return
+            future = self.fetching.get(key)
+            owner = future is None
+            if owner:
+                future = self.fetching[key] = Future()
+        if not owner:
+            return future.result()
+
+        try:
+            size = s3.head_object(Bucket=BUCKET_NAME, Key=key)['ContentLength']
+            if size > self.max_bytes:
+                self._mark_too_large(key, size)
+            else:
+                part_path = self._part_path(key)
+                try:
+                    s3.download_file(BUCKET_NAME, key, part_path)
+                except Exception:
+                    os.remove(part_path)
+                    raise
+                self._commit(key, part_path)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(None)
+        finally:
+            with self.lock:
+                del self.fetching[key]
+
+    def discard(self, key: str):
+        """Drop a clip from the cache, e.g. once it is deleted from S3."""
+        path = self.path_for(key)
+        with self.lock:
+            self.too_large.discard(key)
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)
+                self._remove(path)
+
+    def _part_path(self, key: str) -> str:
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, part_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        os.close(fd)
+        return part_path
+
+    def _commit(self, key: str, part_path: str):
+        path = self.path_for(key)
+        size = os.path.getsize(part_path)
+        if size > self.max_bytes:
+            os.remove(part_path)
+            self._mark_too_large(key, size)
+            return
+        with self.lock:
+            self.too_large.discard(key)
+            os.replace(part_path, path)
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self._evict()
+
+    def _mark_too_large(self, key: str, size: int):
+        print(f"Not caching {key}: {size} bytes exceeds cache size")
+        with self.lock:
+            self.too_large.add(key)
+            # Drop any older, smaller copy stored under the same key
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)
+                self._remove(self.path_for(key))
+
+    def _evict(self):
+        # Caller must hold self.lock
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self._remove(self.path_for(key))
+            print(f"Evicted {key} from video cache")
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def parse_range_header(range_header: str, size: int):
+    """
+    Parse a single "bytes=start-end" Range header into an inclusive (start, end) pair.
+    Returns None if the header should be ignored (malformed or multiple ranges),
+    and raises ValueError if the range cannot be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip() != "bytes" or "," in spec:
+        return None
+    start_str, _, end_str = spec.strip().partition("-")
+    if any(value and not (value.isascii() and value.isdigit()) for value in (start_str, end_str)):
+        return None
+    start = int(start_str) if start_str else None
+    end = int(end_str) if end_str else None
+    if start is None:
+        # Suffix range: the last N bytes
+        if end is None:
+            return None
+        if end == 0 or size == 0:
+            raise ValueError("Range not satisfiable")
+        return max(size - end, 0), size - 1
+    end = size - 1 if end is None else min(end, size - 1)
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+class RangeFileResponse(Response):
+    """
+    Serve an open file with ETag, conditional GET and single-range support.
+    Uses the ASGI zero-copy send extension (os.sendfile) when the server offers it,
+    otherwise streams the range in chunks read off the event loop.
+    """
+    chunk_size = 256 * 1024
+
+    def __init__(self, file, request: Request, media_type: str = "video/mp4"):
+        self.file = file
+        self.media_type = media_type
+        self.background = None
+        self.send_body = request.method != "HEAD"
+
+        stat = os.fstat(file.fileno())
+        size = stat.st_size
+        # A clip is replaced by renaming a new file into place, so inode and mtime
+        # only change when the content does
+        etag = f'"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{size:x}"'
+        headers = {
+            "accept-ranges": "bytes",
+            "etag": etag,
+            "last-modified": formatdate(stat.st_mtime, usegmt=True),
+        }
+
+        self.status_code = 200
+        self.start, self.length = 0, size
+        range_header = request.headers.get("range")
+        if_range = request.headers.get("if-range")
+        if_none_match = request.headers.get("if-none-match")
+
+        if if_none_match and (if_none_match.strip() == "*" or etag in [t.strip() for t in if_none_match.split(",")]):
+            self.status_code = 304
+            self.length = 0
+        elif range_header and (if_range is None or if_range.strip() == etag):
+            try:
+                byte_range = parse_range_header(range_header, size)
+            except ValueError:
+                self.status_code = 416
+                self.length = 0
+                headers["content-range"] = f"bytes */{size}"
+            else:
+                if byte_range is not None:
+                    start, end = byte_range
+                    self.status_code = 206
+                    self.start, self.length = start, end - start + 1
+                    headers["content-range"] = f"bytes {start}-{end}/{size}"
+
+        self.init_headers(headers)
+        if self.status_code != 304:
+            self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if not self.send_body or self.length == 0:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
+            elif "http.response.zerocopysend" in scope.get("extensions", {}):
+                await send({
+                    "type": "http.response.zerocopysend",
+                    "file": self.file,
+                    "offset": self.start,
+                    "count": self.length,
+                    "more_body": False,
+                })
+            else:
+                fd = self.file.fileno()
+                offset, remaining = self.start, self.length
+                while remaining > 0:
+                    chunk = await run_in_threadpool(os.pread, fd, min(self.chunk_size, remaining), offset)
+                    if not chunk:
+                        break
+                    offset += len(chunk)
+                    remaining -= len(chunk)
+                    await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+                if remaining > 0:
+                    # File shrank underneath us; close out the response
+                    await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            self.file.close()
 # init server
 app = FastAPI()
 
@@ -297,6 +597,25 @@ THRESHOLD = timedelta(seconds=10)
 PROCESSED_BIN_COUNT = 0
 BIN_PROCESS_THRESHOLD = 10
 
+# --- Local video cache ---
+VIDEO_CACHE_DIR = os.environ.get("VIDEO_CACHE_DIR", "video_cache")
+VIDEO_CACHE_MAX_BYTES = int(os.environ.get("VIDEO_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+
+# --- Encoding profiles ---
+# preset trades encode speed for compression, crf trades size for quality
+ENCODING_PROFILES = {
+    "fast": EncodingProfile(preset="veryfast", crf=26),
+    "balanced": EncodingProfile(preset="medium", crf=23, preview_height=240),
+    "quality": EncodingProfile(preset="slow", crf=20, preview_height=360),
+}
+
+def get_encoding_profile(name: str) -> EncodingProfile:
+    if name not in ENCODING_PROFILES:
+        raise ValueError(f"Unknown video encoding profile '{name}', expected one of: {', '.join(ENCODING_PROFILES)}")
+    return ENCODING_PROFILES[name]
+
+ENCODING_PROFILE = get_encoding_profile(os.environ.get("VIDEO_ENCODING_PROFILE", "balanced"))
+PREVIEW_PREFIX = "previews/"
 
 
 s3 = boto3.client(
@@ -305,6 +624,24 @@ s3 = boto3.client(
     aws_secret_access_key=aws_secret_access_key
 )
 
+video_cache = VideoCache(VIDEO_CACHE_DIR, VIDEO_CACHE_MAX_BYTES)
+
+def update_video_cache(new_files, stale_keys=()):
+    """
+    Best-effort local cache update after clips are written to S3. A failure here
+    only means the clip is fetched from S3 on its first request.
+    """
+    for key in stale_keys:
+        try:
+            video_cache.discard(key)
+        except Exception as e:
+            print(f"Failed to remove {key} from video cache: {str(e)}")
+    for key, file_path in new_files:
+        try:
+            video_cache.put_file(key, file_path)
+        except Exception as e:
+            print(f"Failed to add {key} to video cache: {str(e)}")
+
 def upload_to_s3(file_name: str, file_content: bytes, content_type: str):
     print(f"Uploading {file_name} to S3 has content type {content_type}")
     print("Uploading to S3 bucket: ", BUCKET_NAME)
@@ -338,26 +675,58 @@ async def upload_file(background_tasks: BackgroundTasks, file: UploadFile = File
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/get-videos")
-async def get_videos():
+async def get_videos(request: Request):
 
     try:
         bucket_name = 'wingwatcher-videos'
-        bucket_list = s3.list_objects_v2(Bucket=bucket_name)
+        videos = list_objects("videos/", bucket_name)
         response = []
-        if 'Contents' in bucket_list:
-            for obj in bucket_list['Contents']:
-                if obj['Key'].startswith("videos/") and len(obj["Key"]) > 7:
+        if videos:
+            preview_keys = {obj['Key'] for obj in list_objects(PREVIEW_PREFIX, bucket_name)}
+            for obj in videos:
+                if len(obj["Key"]) > 7:
                     print(obj['Key'])
-                    response.append({"title": obj['Key'], "videoLink": "https://wingwatcher-videos.s3.amazonaws.com/" + obj['Key']})
+                    video_link = str(request.url_for("stream_video", key=obj['Key']))
+                    renditions = [{"name": "full", "videoLink": video_link}]
+                    preview_key = preview_key_for(obj['Key'])
+                    if preview_key in preview_keys:
+                        renditions.append({"name": "preview", "videoLink": str(request.url_for("stream_video", key=preview_key))})
+                    response.append({"title": obj['Key'], "videoLink": video_link, "renditions": renditions})
             return response
         else:
             print(f"No files found in bucket {bucket_name}")
-        return bucket_list
+        return response
         
     except Exception as e:
         print(f"An error occurred: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.api_route("/stream/{key:path}", methods=["GET", "HEAD"])
+async def stream_video(key: str, request: Request):
+    """Serve a video from the local cache, pulling it from S3 on a miss."""
+    try:
+        file = await run_in_threadpool(video_cache.open, key)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Video not found")
+
+    if file is None:
+        try:
+            await run_in_threadpool(video_cache.fetch, key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey"):
+                raise HTTPException(status_code=404, detail="Video not found")
+            print(f"Error fetching {key} from S3: {str(e)}")
+            raise HTTPException(status_code=502, detail=str(e))
+        except Exception as e:
+            print(f"Error fetching {key} from S3: {str(e)}")
+            raise HTTPException(status_code=502, detail=str(e))
+        file = await run_in_threadpool(video_cache.open, key)
+        if file is None:
+            # Too large to cache; let the client go to S3 directly
+            return RedirectResponse(f"https://{BUCKET_NAME}.s3.amazonaws.com/{key}")
+
+    return await run_in_threadpool(RangeFileResponse, file, request)
+
 @app.get("/get-last-connected")
 async def fetch_last_connected_timestamp():
     """Fetch the list of device tokens stored in the S3 bucket."""
@@ -396,7 +765,55 @@ def is_jpeg(data):
     # Check if the data starts with the JPEG start marker and ends with the JPEG end marker
     return data.startswith(b'\xff\xd8') and data.endswith(b'\xff\xd9')
 
-def process_bin_file(data, output_dir: str, video_file: str):
+def preview_key_for(video_key: str) -> str:
+    """S3 key of the preview rendition for a full-quality video key."""
+    return PREVIEW_PREFIX + os.path.basename(video_key)
+
+def preview_path_for(video_path: str) -> str:
+    root, ext = os.path.splitext(video_path)
+    return f"{root}_preview{ext}"
+
+def wants_preview(profile: EncodingProfile, source_height: int | None) -> bool:
+    """Only make a preview when the profile has one and it would be smaller than the source."""
+    return bool(profile.preview_height) and source_height is not None and source_height > profile.preview_height
+
+def probe_video_height(video_path: str) -> int | None:
+    """Read the height of the first video stream with ffprobe, or None if it can't be read."""
+    try:
+        result = subprocess.run(['ffprobe', '-v', 'error', '-select_streams', 'v:0', '-show_entries', 'stream=height',
+                                 '-of', 'csv=p=0', video_path], capture_output=True, text=True)
+    except OSError as e:
+        print(f"Could not run ffprobe on {video_path}: {str(e)}")
+        return None
+    try:
+        return int(result.stdout.strip())
+    except ValueError:
+        print(f"Could not read video height of {video_path}: {result.stderr.strip()}")
+        return None
+
+def build_rendition_args(profile: EncodingProfile, video_path: str, preview_path: str | None = None, copy_full: bool = False) -> List[str]:
+    """
+    Build ffmpeg output arguments for the full rendition and, if preview_path is set,
+    a scaled-down preview encoded from the same decode of input 0.
+    With copy_full the full rendition is stream-copied rather than re-encoded.
+    """
+    full_codec = ['-c', 'copy'] if copy_full else ['-c:v', 'libx264', '-preset', profile.preset, '-crf', str(profile.crf), '-pix_fmt', 'yuv420p']
+    preview_codec = ['-c:v', 'libx264', '-preset', profile.preset, '-crf', str(profile.preview_crf), '-pix_fmt', 'yuv420p']
+    faststart = ['-movflags', '+faststart']
+
+    if preview_path is None:
+        return full_codec + faststart + [video_path]
+    # Never upscale, even if the caller didn't check the source height
+    scale = f"scale=-2:'min({profile.preview_height},ih)'"
+    if copy_full:
+        # A copied stream can't come out of a filter graph, so only the preview branch is decoded
+        return (['-map', '0:v'] + full_codec + faststart + [video_path]
+                + ['-map', '0:v', '-vf', scale] + preview_codec + faststart + [preview_path])
+    return (['-filter_complex', f'[0:v]split=2[full][prev];[prev]{scale}[preview]']
+            + ['-map', '[full]'] + full_codec + faststart + [video_path]
+            + ['-map', '[preview]'] + preview_codec + faststart + [preview_path])
+
+def process_bin_file(data, output_dir: str, video_file: str, profile: EncodingProfile = ENCODING_PROFILE):
     # data = await bin_file.read()
     # print(data)
 
@@ -425,22 +842,37 @@ def process_bin_file(data, output_dir: str, video_file: str):
         print(f'Extracted {image_number} images to {output_dir}')
 
     # Create a video from the images using ffmpeg
-    if image_files:
-
-        # Assuming images are named image_001.jpg, image_002.jpg, ...
-        ffmpeg_input_pattern = os.path.join(output_dir, 'frame_%04d.jpg')
-        
-        subprocess.run(['ffmpeg', '-framerate', '20', '-i', ffmpeg_input_pattern, '-c:v', 'libx264', '-pix_fmt', 'yuv420p', video_file])
-        # print("got here")
-        # Upload the video to S3
-        video_bytes = open(video_file, 'rb').read()
-        upload_to_s3(os.path.join("videos", os.path.basename(video_file)), video_bytes, 'video/mp4')
-
+    try:
+        if image_files:
+
+            # Assuming images are named image_001.jpg, image_002.jpg, ...
+            ffmpeg_input_pattern = os.path.join(output_dir, 'frame_%04d.jpg')
+
+            with Image.open(os.path.join(output_dir, image_files[0])) as first_frame:
+                source_height = first_frame.height
+            preview_file = preview_path_for(video_file) if wants_preview(profile, source_height) else None
+            subprocess.run(['ffmpeg', '-framerate', '20', '-i', ffmpeg_input_pattern]
+                           + build_rendition_args(profile, video_file, preview_file), check=True)
+            # print("got here")
+            # Upload the video to S3
+            video_bytes = open(video_file, 'rb').read()
+            video_key = os.path.join("videos", os.path.basename(video_file))
+            upload_to_s3(video_key, video_bytes, 'video/mp4')
+            cached_files = [(video_key, video_file)]
+
+            if preview_file:
+                preview_key = preview_key_for(video_key)
+                preview_bytes = open(preview_file, 'rb').read()
+                upload_to_s3(preview_key, preview_bytes, 'video/mp4')
+                cached_files.append((preview_key, preview_file))
+
+            update_video_cache(cached_files)
+        else:
+            print("No images were extracted from the .bin file.")
+    finally:
         # Clean up the temporary files
-        shutil.rmtree(output_dir)
-        shutil.rmtree(os.path.dirname(video_file))
-    else:
-        print("No images were extracted from the .bin file.")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        shutil.rmtree(os.path.dirname(video_file), ignore_errors=True)
 
 
 @app.post("/upload-bin")
@@ -536,9 +968,16 @@ def extract_timestamp_from_key(key):
         return datetime.datetime.strptime(match.group(1), '%Y%m%d_%H%M%S')
     return None
 
+def list_objects(prefix: str, bucket: str = BUCKET_NAME):
+    """List every object under a prefix, following list_objects_v2 pagination."""
+    paginator = s3.get_paginator('list_objects_v2')
+    objects = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects.extend(page.get('Contents', []))
+    return objects
+
 def list_videos():
-    response = s3.list_objects_v2(Bucket=BUCKET_NAME, Prefix="videos/")
-    video_list = response.get('Contents', [])
+    video_list = list_objects("videos/")
     return video_list
 
 def group_video_files(video_list, threshold):
@@ -570,15 +1009,19 @@ def download_video(bucket, key, download_path):
     """Download a video from S3 to the specified local path."""
     s3.download_file(bucket, key, download_path)
 
-def concatenate_videos(video_paths, output_path):
-    """Concatenate multiple videos into a single video using ffmpeg."""
+def concatenate_videos(video_paths, output_path, preview_path=None, profile: EncodingProfile = ENCODING_PROFILE):
+    """
+    Concatenate multiple videos into a single video using ffmpeg.
+    The clips are already encoded with the profile, so the full rendition is
+    stream-copied; a preview, if requested, is encoded in the same pass.
+    """
     with tempfile.NamedTemporaryFile('w', delete=False) as list_file:
         for path in video_paths:
             list_file.write(f"file '{path}'\n")
         list_file_path = list_file.name
 
-    subprocess.run(['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_file_path,
-                    '-c', 'copy', output_path], check=True)
+    subprocess.run(['ffmpeg', '-f', 'concat', '-safe', '0', '-i', list_file_path]
+                   + build_rendition_args(profile, output_path, preview_path, copy_full=True), check=True)
     os.remove(list_file_path)
 
 def upload_video(bucket, key, file_path):
@@ -596,7 +1039,7 @@ def delete_original_videos(bucket, keys):
     response = s3.delete_objects(Bucket=bucket, Delete={'Objects': objects})
     return response
 
-def batch_video_files():
+def batch_video_files(profile: EncodingProfile = ENCODING_PROFILE):
     videos = list_videos()
     videos = [v for v in videos if extract_timestamp_from_key(v['Key']) is not None]
     videos.sort(key=lambda v: extract_timestamp_from_key(v['Key']))
@@ -617,15 +1060,30 @@ def batch_video_files():
                 video_paths.append(download_path)
 
             output_filename = f"{extract_timestamp_from_key(group[0]['Key']).strftime('%Y%m%d_%H%M%S')}.mp4"
-            output_path = os.path.join(temp_dir, output_filename)
-
-            concatenate_videos(video_paths, output_path)
-
-            upload_video(BUCKET_NAME, f"videos/{output_filename}", output_path)
-
-            delete_original_videos(BUCKET_NAME, original_keys)
-
-            clean_up(video_paths + [output_path])
+            # The first original was downloaded under output_filename, so write the output elsewhere
+            output_path = os.path.join(temp_dir, f"concatenated_{output_filename}")
+            output_key = f"videos/{output_filename}"
+            source_height = probe_video_height(video_paths[0]) if profile.preview_height else None
+            preview_path = preview_path_for(output_path) if wants_preview(profile, source_height) else None
+
+            concatenate_videos(video_paths, output_path, preview_path, profile)
+
+            upload_video(BUCKET_NAME, output_key, output_path)
+            if preview_path:
+                upload_video(BUCKET_NAME, preview_key_for(output_key), preview_path)
+
+            # Originals may have previews from an earlier profile, so remove those too,
+            # but keep the keys the concatenated renditions were just uploaded under
+            new_keys = {output_key, preview_key_for(output_key)} if preview_path else {output_key}
+            stale_keys = [key for key in original_keys + [preview_key_for(key) for key in original_keys] if key not in new_keys]
+            delete_original_videos(BUCKET_NAME, stale_keys)
+
+            cached_files = [(output_key, output_path)]
+            if preview_path:
+                cached_files.append((preview_key_for(output_key), preview_path))
+            update_video_cache(cached_files, stale_keys)
+
+            clean_up(video_paths + [output_path] + ([preview_path] if preview_path else []))
     print("Video collation and concatenation completed")
 
 
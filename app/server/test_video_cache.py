@@ -0,0 +1,227 @@
+# unit tests for the local video cache and the /stream endpoint
+# to run: poetry run python3 -m unittest test_video_cache
+import asyncio
+import os
+import shutil
+import threading
+import time
+import unittest
+from unittest import mock
+
+from video_test_env import VideoCacheTestCase, main
+
+from botocore.exceptions import EndpointConnectionError
+from starlette.requests import Request
+from fastapi.testclient import TestClient
+
+from main import VideoCache, RangeFileResponse, parse_range_header
+
+
+def make_request(headers=None, method="GET"):
+    raw_headers = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": method, "headers": raw_headers})
+
+
+class FakeS3:
+    """Serves every key from one local file and records each S3 call."""
+    def __init__(self, clip, delay=0):
+        self.clip = clip
+        self.delay = delay
+        self.heads = []
+        self.downloads = []
+
+    def head_object(self, Bucket, Key):
+        self.heads.append(Key)
+        return {"ContentLength": os.path.getsize(self.clip)}
+
+    def download_file(self, bucket, key, path):
+        self.downloads.append(key)
+        time.sleep(self.delay)
+        shutil.copyfile(self.clip, path)
+
+
+class ParseRangeHeaderTest(unittest.TestCase):
+    def test_valid_ranges(self):
+        self.assertEqual(parse_range_header("bytes=0-99", 100), (0, 99))
+        self.assertEqual(parse_range_header("bytes=10-", 100), (10, 99))
+        self.assertEqual(parse_range_header("bytes=-5", 100), (95, 99))
+        self.assertEqual(parse_range_header("bytes=-500", 100), (0, 99))
+        self.assertEqual(parse_range_header("bytes=90-1000", 100), (90, 99))
+
+    def test_ignored_ranges(self):
+        for header in ["bytes=0-1,3-4", "items=0-1", "bytes=a-b", "bytes=-", "bytes=--5",
+                       "bytes=+1-2", "bytes= 1_0-2_0", "bytes=1 -2", "bytes=１-2"]:
+            with self.subTest(header=header):
+                self.assertIsNone(parse_range_header(header, 100))
+
+    def test_unsatisfiable_ranges(self):
+        for header, size in [("bytes=100-", 100), ("bytes=-0", 100), ("bytes=5-2", 100),
+                             ("bytes=0-", 0), ("bytes=-5", 0)]:
+            with self.subTest(header=header, size=size):
+                with self.assertRaises(ValueError):
+                    parse_range_header(header, size)
+
+
+class VideoCacheTest(VideoCacheTestCase):
+    def test_rejects_invalid_keys(self):
+        for key in ["videos/../videos/a.mp4", "videos/x/../../evil.mp4", "videos/./a.mp4",
+                    "videos//a.mp4", "videos/", "/videos/a.mp4", "images/a.png", "videos/a/.."]:
+            with self.subTest(key=key):
+                with self.assertRaises(ValueError):
+                    self.cache.put_file(key, self.clip)
+                with self.assertRaises(ValueError):
+                    self.cache.fetch(key)
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+        self.assertEqual(self.cache.total_bytes, 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.put_file("videos/a.mp4", self.clip)
+        self.cache.put_file("videos/b.mp4", self.clip)
+        self.cache.open("videos/a.mp4").close()
+        self.cache.put_file("previews/c.mp4", self.clip)
+        self.assertEqual(list(self.cache.entries), ["videos/a.mp4", "previews/c.mp4"])
+        self.assertEqual(self.cache.total_bytes, 200)
+        self.assertIsNone(self.cache.open("videos/b.mp4"))
+
+    def test_reload_keeps_lru_order(self):
+        self.cache.put_file("videos/a.mp4", self.clip)
+        time.sleep(0.01)
+        self.cache.put_file("videos/b.mp4", self.clip)
+        time.sleep(0.01)
+        self.cache.open("videos/a.mp4").close()
+        reloaded = VideoCache(self.cache.cache_dir, 250)
+        self.assertEqual(list(reloaded.entries), ["videos/b.mp4", "videos/a.mp4"])
+        self.assertEqual(reloaded.total_bytes, 200)
+
+    def test_etag_stable_across_reads(self):
+        self.cache.put_file("videos/a.mp4", self.clip)
+        first = RangeFileResponse(self.cache.open("videos/a.mp4"), make_request())
+        second = RangeFileResponse(self.cache.open("videos/a.mp4"), make_request())
+        first.file.close()
+        second.file.close()
+        self.assertEqual(first.headers["etag"], second.headers["etag"])
+        self.assertEqual(first.headers["last-modified"], second.headers["last-modified"])
+
+        self.cache.put_file("videos/a.mp4", self.clip)
+        replaced = RangeFileResponse(self.cache.open("videos/a.mp4"), make_request())
+        replaced.file.close()
+        self.assertNotEqual(first.headers["etag"], replaced.headers["etag"])
+
+    def test_conditional_requests(self):
+        self.cache.put_file("videos/a.mp4", self.clip)
+        response = RangeFileResponse(self.cache.open("videos/a.mp4"), make_request())
+        response.file.close()
+        etag = response.headers["etag"]
+
+        cases = [
+            ({"if-none-match": etag}, 304),
+            ({"range": "bytes=10-19", "if-range": etag}, 206),
+            ({"range": "bytes=10-19", "if-range": '"stale"'}, 200),
+            ({"range": "bytes=200-"}, 416),
+        ]
+        for headers, status in cases:
+            with self.subTest(headers=headers):
+                response = RangeFileResponse(self.cache.open("videos/a.mp4"), make_request(headers))
+                response.file.close()
+                self.assertEqual(response.status_code, status)
+
+    def test_concurrent_misses_share_one_download(self):
+        fake_s3 = FakeS3(self.clip, delay=0.1)
+        with mock.patch.object(main, "s3", fake_s3):
+            threads = [threading.Thread(target=self.cache.fetch, args=("videos/a.mp4",)) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(fake_s3.downloads, ["videos/a.mp4"])
+        self.assertEqual(self.cache.total_bytes, 100)
+
+    def test_update_is_best_effort(self):
+        with mock.patch.object(self.cache, "put_file", side_effect=OSError("No space left on device")) as put_file:
+            main.update_video_cache([("videos/a.mp4", self.clip), ("previews/a.mp4", self.clip)])
+        self.assertEqual(put_file.call_count, 2)
+
+
+class RangeFileResponseTest(VideoCacheTestCase):
+    def send_response(self, headers, extensions):
+        self.cache.put_file("videos/a.mp4", self.clip)
+        response = RangeFileResponse(self.cache.open("videos/a.mp4"), make_request(headers))
+        messages = []
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(response({"type": "http", "extensions": extensions}, None, send))
+        self.assertTrue(response.file.closed)
+        return messages
+
+    def test_zero_copy_send(self):
+        messages = self.send_response({"range": "bytes=10-19"}, {"http.response.zerocopysend": {}})
+        self.assertEqual(messages[0]["status"], 206)
+        self.assertEqual(len(messages), 2)
+        self.assertEqual(messages[1]["type"], "http.response.zerocopysend")
+        self.assertEqual((messages[1]["offset"], messages[1]["count"]), (10, 10))
+        self.assertFalse(messages[1]["more_body"])
+
+    def test_chunked_fallback(self):
+        with mock.patch.object(RangeFileResponse, "chunk_size", 4):
+            messages = self.send_response({"range": "bytes=10-19"}, {})
+        bodies = messages[1:]
+        self.assertTrue(all(m["type"] == "http.response.body" for m in bodies))
+        self.assertEqual(b"".join(m["body"] for m in bodies), bytes(range(10, 20)))
+        self.assertEqual([m["more_body"] for m in bodies], [True, True, False])
+
+
+class StreamVideoTest(VideoCacheTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = TestClient(main.app)
+
+    def test_full_and_range_responses(self):
+        self.cache.put_file("videos/a.mp4", self.clip)
+        response = self.client.get("/stream/videos/a.mp4")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, bytes(range(100)))
+        self.assertEqual(response.headers["accept-ranges"], "bytes")
+
+        response = self.client.get("/stream/videos/a.mp4", headers={"range": "bytes=10-19"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, bytes(range(10, 20)))
+        self.assertEqual(response.headers["content-range"], "bytes 10-19/100")
+
+        response = self.client.get("/stream/videos/a.mp4", headers={"if-none-match": response.headers["etag"]})
+        self.assertEqual(response.status_code, 304)
+
+    def test_miss_fetches_once(self):
+        fake_s3 = FakeS3(self.clip)
+        with mock.patch.object(main, "s3", fake_s3):
+            for _ in range(3):
+                response = self.client.get("/stream/videos/a.mp4", headers={"range": "bytes=0-9"})
+                self.assertEqual(response.status_code, 206)
+        self.assertEqual(fake_s3.downloads, ["videos/a.mp4"])
+
+    def test_too_large_redirects_without_download(self):
+        self.cache.max_bytes = 50
+        fake_s3 = FakeS3(self.clip)
+        with mock.patch.object(main, "s3", fake_s3):
+            for _ in range(3):
+                response = self.client.get("/stream/videos/big.mp4", headers={"range": "bytes=0-9"},
+                                           follow_redirects=False)
+                self.assertEqual(response.status_code, 307)
+                self.assertEqual(response.headers["location"], "https://wingwatcher-videos.s3.amazonaws.com/videos/big.mp4")
+        self.assertEqual(fake_s3.downloads, [])
+        self.assertEqual(fake_s3.heads, ["videos/big.mp4"])
+
+    def test_fetch_error_returns_502(self):
+        with mock.patch.object(self.cache, "fetch", side_effect=EndpointConnectionError(endpoint_url="https://s3")):
+            response = self.client.get("/stream/videos/a.mp4")
+        self.assertEqual(response.status_code, 502)
+
+    def test_invalid_key(self):
+        response = self.client.get("/stream/videos/x/%2E%2E/%2E%2E/evil.mp4")
+        self.assertEqual(response.status_code, 404)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+# unit tests for the encoding profiles, ffmpeg arguments and /get-videos renditions
+# to run: poetry run python3 -m unittest test_video_encoding
+import os
+import subprocess
+import unittest
+from io import BytesIO
+from unittest import mock
+
+from video_test_env import VideoCacheTestCase, main
+
+from PIL import Image
+from fastapi.testclient import TestClient
+
+from main import EncodingProfile, build_rendition_args, get_encoding_profile, probe_video_height, wants_preview
+
+PROFILE = EncodingProfile(preset="medium", crf=23, preview_height=240)
+
+
+class EncodingProfileTest(unittest.TestCase):
+    def test_unknown_profile(self):
+        with self.assertRaisesRegex(ValueError, "balnced.*fast, balanced, quality"):
+            get_encoding_profile("balnced")
+
+    def test_wants_preview_only_when_smaller(self):
+        self.assertTrue(wants_preview(PROFILE, 480))
+        self.assertFalse(wants_preview(PROFILE, 240))
+        self.assertFalse(wants_preview(PROFILE, 120))
+        self.assertFalse(wants_preview(PROFILE, None))
+        self.assertFalse(wants_preview(EncodingProfile(preset="veryfast", crf=26), 480))
+
+    def test_probe_without_ffprobe(self):
+        with mock.patch.object(main.subprocess, "run", side_effect=FileNotFoundError("ffprobe")):
+            self.assertIsNone(probe_video_height("a.mp4"))
+
+
+class BuildRenditionArgsTest(unittest.TestCase):
+    def test_single_rendition(self):
+        self.assertEqual(build_rendition_args(PROFILE, "a.mp4"), [
+            '-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart', 'a.mp4',
+        ])
+
+    def test_split_preview(self):
+        self.assertEqual(build_rendition_args(PROFILE, "a.mp4", "a_preview.mp4"), [
+            '-filter_complex', "[0:v]split=2[full][prev];[prev]scale=-2:'min(240,ih)'[preview]",
+            '-map', '[full]', '-c:v', 'libx264', '-preset', 'medium', '-crf', '23', '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart', 'a.mp4',
+            '-map', '[preview]', '-c:v', 'libx264', '-preset', 'medium', '-crf', '28', '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart', 'a_preview.mp4',
+        ])
+
+    def test_copy_with_preview(self):
+        self.assertEqual(build_rendition_args(PROFILE, "a.mp4", "a_preview.mp4", copy_full=True), [
+            '-map', '0:v', '-c', 'copy', '-movflags', '+faststart', 'a.mp4',
+            '-map', '0:v', '-vf', "scale=-2:'min(240,ih)'",
+            '-c:v', 'libx264', '-preset', 'medium', '-crf', '28', '-pix_fmt', 'yuv420p',
+            '-movflags', '+faststart', 'a_preview.mp4',
+        ])
+
+    def test_copy_only(self):
+        self.assertEqual(build_rendition_args(PROFILE, "a.mp4", copy_full=True),
+                         ['-c', 'copy', '-movflags', '+faststart', 'a.mp4'])
+
+
+class ProcessBinFileTest(VideoCacheTestCase):
+    def test_cleans_up_when_ffmpeg_fails(self):
+        output_dir = os.path.join(self.temp_dir, "temp", "images")
+        os.makedirs(output_dir)
+        video_file = os.path.join(self.temp_dir, "temp", "clip.mp4")
+        frame = BytesIO()
+        Image.new("RGB", (320, 240)).save(frame, format="JPEG")
+
+        with mock.patch.object(main.subprocess, "run", side_effect=subprocess.CalledProcessError(1, "ffmpeg")) as run, \
+                mock.patch.object(main, "upload_to_s3") as upload:
+            with self.assertRaises(subprocess.CalledProcessError):
+                main.process_bin_file(frame.getvalue() * 2, output_dir, video_file)
+
+        # 240p frames are already preview sized, so only the full rendition is encoded
+        self.assertNotIn("[preview]", run.call_args.args[0])
+        upload.assert_not_called()
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, "temp")))
+
+
+class BatchVideoFilesTest(VideoCacheTestCase):
+    def test_uses_one_profile(self):
+        profile = EncodingProfile(preset="slow", crf=20, preview_height=120)
+        fake_s3 = mock.Mock()
+        fake_s3.get_paginator.return_value.paginate.return_value = [{"Contents": [
+            {"Key": "videos/20250101_120000.mp4"}, {"Key": "videos/20250101_120005.mp4"}]}]
+        fake_s3.download_file.side_effect = lambda bucket, key, path: open(path, "wb").close()
+
+        def concatenate(video_paths, output_path, preview_path, profile):
+            for path in [output_path, preview_path]:
+                with open(path, "wb") as f:
+                    f.write(b"clip")
+
+        with mock.patch.object(main, "s3", fake_s3), \
+                mock.patch.object(main, "probe_video_height", return_value=240), \
+                mock.patch.object(main, "concatenate_videos", side_effect=concatenate) as concatenate_videos:
+            main.batch_video_files(profile)
+
+        self.assertIs(concatenate_videos.call_args.args[3], profile)
+        self.assertTrue(concatenate_videos.call_args.args[2].endswith("_preview.mp4"))
+        self.assertEqual(list(self.cache.entries), ["videos/20250101_120000.mp4", "previews/20250101_120000.mp4"])
+
+
+class GetVideosTest(VideoCacheTestCase):
+    def test_lists_renditions_across_pages(self):
+        pages = {
+            "videos/": [{"Contents": [{"Key": "videos/"}, {"Key": "videos/20250101_120000.mp4"}]},
+                        {"Contents": [{"Key": "videos/20250102_120000.mp4"}]}],
+            "previews/": [{"Contents": [{"Key": "previews/20250102_120000.mp4"}]}],
+        }
+        fake_s3 = mock.Mock()
+        fake_s3.get_paginator.return_value.paginate.side_effect = lambda Bucket, Prefix: pages[Prefix]
+
+        with mock.patch.object(main, "s3", fake_s3):
+            response = TestClient(main.app).get("/get-videos")
+
+        self.assertEqual(response.status_code, 200)
+        videos = response.json()
+        self.assertEqual([v["title"] for v in videos], ["videos/20250101_120000.mp4", "videos/20250102_120000.mp4"])
+        self.assertEqual([r["name"] for r in videos[0]["renditions"]], ["full"])
+        self.assertEqual([r["name"] for r in videos[1]["renditions"]], ["full", "preview"])
+        self.assertTrue(videos[1]["renditions"][1]["videoLink"].endswith("/stream/previews/20250102_120000.mp4"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+# shared setup for the video unit tests: import this before main
+import atexit
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+# main.py reads these at import time. The import-time cache is never used by
+# the tests, which swap in their own VideoCache.
+IMPORT_CACHE_DIR = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, IMPORT_CACHE_DIR, ignore_errors=True)
+os.environ["VIDEO_CACHE_DIR"] = IMPORT_CACHE_DIR
+for name in ["APNS_KEY_FILE", "APNS_KEY_ID", "TEAM_ID", "APP_BUNDLE_ID", "AWS_ACCESS_KEY_ID", "AWS_SECRET_ACCESS_KEY"]:
+    os.environ.setdefault(name, "test")
+
+import main
+
+
+class VideoCacheTestCase(unittest.TestCase):
+    """Gives each test a temp dir, a 100-byte clip and its own VideoCache in place of main.video_cache."""
+    cache_max_bytes = 250
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir)
+        self.cache = main.VideoCache(os.path.join(self.temp_dir, "cache"), self.cache_max_bytes)
+        patcher = mock.patch.object(main, "video_cache", self.cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.clip = os.path.join(self.temp_dir, "clip.mp4")
+        with open(self.clip, "wb") as f:
+            f.write(bytes(range(100)))